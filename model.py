@@ -1,7 +1,22 @@
 import numpy as np
 import tensorflow as tf
-from tensorflow.keras.layers import Concatenate, Dense, LSTM
-from typing import Union
+from tensorflow.keras.initializers import GlorotUniform, Orthogonal
+from tensorflow.keras.layers import Dense, LSTMCell
+from typing import NamedTuple, Optional, Tuple, Union
+
+
+class DNCState(NamedTuple):
+    """ Recurrent state of the DNC carried from one timestep to the next. """
+    h: tf.Tensor  # [1,Y+I]
+    c: tf.Tensor  # [1,Y+I]
+    M: tf.Tensor  # [N,W]
+    M_norm: tf.Tensor  # [N,1]
+    usage: tf.Tensor  # [N,1]
+    L: tf.Tensor  # [N,N]
+    W_precedence: tf.Tensor  # [N,1]
+    W_read: tf.Tensor  # [N,R]
+    W_write: tf.Tensor  # [N,1]
+    read_v: tf.Tensor  # [R,W]
 
 
 class DNC(tf.keras.Model):
@@ -10,6 +25,9 @@ class DNC(tf.keras.Model):
                  output_dim: int,
                  memory_shape: tuple = (100, 20),
                  n_read: int = 3,
+                 mixed_precision: bool = False,
+                 seed: int = 0,
+                 alloc_k: Optional[int] = None,
                  name: str = 'dnc'
                  ) -> None:
         """
@@ -23,11 +41,31 @@ class DNC(tf.keras.Model):
             Shape of memory matrix (rows, cols).
         n_read
             Number of read heads.
+        mixed_precision
+            Whether to compute the controller output, interface and read vector projections
+            in bfloat16. The weights, memory state and content lookups stay in float32.
+        seed
+            Seed of the initializers of the controller state, the projection weights and the
+            controller Dense and LSTM layers. With the default seed every instance starts from
+            the same W_out_iface, W_read_out and controller_state, pass a different seed per
+            instance to get independently initialized models.
+        alloc_k
+            Number of least used memory rows considered for allocation, defaults to
+            min(N, max(8, N // 4)). Pass N (the number of memory rows) for exact allocation,
+            see allocation_weighting for the error of smaller values.
         name
             Name of DNC.
         """
         super(DNC, self).__init__(name=name)
 
+        # deterministic truncated normal initializer, each variable gets its own counter in the seed
+        def truncated_normal(shape: list, counter: int) -> tf.Tensor:
+            return tf.random.stateless_truncated_normal(shape, seed=[seed, counter], stddev=0.1)
+
+        # integer seed for the Keras initializers of the controller layers, derived the same way
+        def initializer_seed(counter: int) -> int:
+            return int(tf.random.stateless_uniform([], seed=[seed, counter], maxval=2 ** 31 - 1, dtype=tf.int32))
+
         # define output data size
         self.output_dim = output_dim  # Y
 
@@ -37,71 +75,123 @@ class DNC(tf.keras.Model):
         # define number of read heads
         self.R = n_read  # R
 
+        # dtype of the controller output, interface and read vector projections
+        self.projection_dtype = tf.bfloat16 if mixed_precision else tf.float32
+
         # size of output vector from controller that defines interactions with memory matrix:
         # R read keys + R read strengths + write key + write strength + erase vector +
         # write vector + R free gates + allocation gate + write gate + R read modes
         self.interface_dim = self.R * self.W + 3 * self.W + 5 * self.R + 3  # I
 
+        # number of least used memory rows considered for allocation
+        self.alloc_k = min(self.N, max(8, self.N // 4)) if alloc_k is None else alloc_k  # K
+
+        # sizes of the interface vector partitions, in the order listed above
+        self.interface_splits = [self.R * self.W, self.R, self.W, 1, self.W, self.W, self.R, 1, 1, 3 * self.R]
+
         # neural net output = output of controller + interface vector with memory
         self.controller_dim = self.output_dim + self.interface_dim  # Y+I
 
         # initialize controller output and interface vector with gaussian normal
-        self.output_v = tf.random.truncated_normal([1, self.output_dim], stddev=0.1)  # [1,Y]
-        self.interface = tf.random.truncated_normal([1, self.interface_dim], stddev=0.1)  # [1,I]
+        # both are only kept for inspection: they are updated in place with their values at the
+        # last timestep of each call but are not read by the model itself
+        self.output_v = tf.Variable(  # [1,Y]
+            truncated_normal([1, self.output_dim], 0), trainable=False, name='dnc_output_v'
+        )
+        self.interface = tf.Variable(  # [1,I]
+            truncated_normal([1, self.interface_dim], 1), trainable=False, name='dnc_interface'
+        )
 
+        # the memory state is kept in non-trainable variables in between calls so that it can be
+        # updated in place; within a call it is threaded through the timesteps as a DNCState
         # initialize memory matrix with zeros
-        self.M = tf.zeros(memory_shape)  # [N,W]
+        self.M = tf.Variable(tf.zeros(memory_shape), trainable=False, name='dnc_M')  # [N,W]
+
+        # l2 norm of each memory row, cached after every write for the content lookups
+        # the norm of an empty row is clipped to 1e-6 like in tf.nn.l2_normalize
+        self.M_norm = tf.Variable(tf.fill([self.N, 1], 1e-6), trainable=False, name='dnc_M_norm')  # [N,1]
 
         # usage vector records which locations in the memory are used and which are free
-        self.usage = tf.fill([self.N, 1], 1e-6)  # [N,1]
+        self.usage = tf.Variable(tf.zeros([self.N, 1]), trainable=False, name='dnc_usage')  # [N,1]
 
         # temporal link matrix L[i,j] records to which degree location i was written to after j
-        self.L = tf.zeros([self.N, self.N])  # [N,N]
+        self.L = tf.Variable(tf.zeros([self.N, self.N]), trainable=False, name='dnc_L')  # [N,N]
+
+        # mask applied after each link matrix update since a location cannot link to itself
+        self.L_mask = tf.constant(1 - np.identity(self.N, dtype=np.float32))  # [N,N]
 
         # precedence vector determines degree to which a memory row was written to at t-1
-        self.W_precedence = tf.zeros([self.N, 1])  # [N,1]
+        self.W_precedence = tf.Variable(  # [N,1]
+            tf.zeros([self.N, 1]), trainable=False, name='dnc_W_precedence'
+        )
 
-        # initialize R read weights and vectors and write weights
-        self.W_read = tf.fill([self.N, self.R], 1e-6)  # [N,R]
-        self.W_write = tf.fill([self.N, 1], 1e-6)  # [N,1]
-        self.read_v = tf.fill([self.R, self.W], 1e-6)  # [R,W]
+        # initialize R read weights and vectors and write weights with zeros
+        self.W_read = tf.Variable(tf.zeros([self.N, self.R]), trainable=False, name='dnc_W_read')  # [N,R]
+        self.W_write = tf.Variable(tf.zeros([self.N, 1]), trainable=False, name='dnc_W_write')  # [N,1]
+        self.read_v = tf.Variable(tf.zeros([self.R, self.W]), trainable=False, name='dnc_read_v')  # [R,W]
 
         # controller variables
-        # initialize controller hidden state
-        self.h = tf.Variable(tf.random.truncated_normal([1, self.controller_dim], stddev=0.1), name='dnc_h')  # [1,Y+I]
-        self.c = tf.Variable(tf.random.truncated_normal([1, self.controller_dim], stddev=0.1), name='dnc_c')  # [1,Y+I]
+        # initialize controller hidden and cell states, stacked in a single variable
+        self.controller_state = tf.Variable(  # [2,1,Y+I]
+            truncated_normal([2, 1, self.controller_dim], 2),
+            trainable=False,
+            name='dnc_controller_state'
+        )
 
-        # initialise Dense and LSTM layers of the controller
-        self.dense = Dense(self.W, activation=None)
-        self.lstm = LSTM(
+        # initialise Dense layer and LSTM cell of the controller
+        self.dense = Dense(self.W, activation=None, kernel_initializer=GlorotUniform(seed=initializer_seed(6)))
+        self.lstm_cell = LSTMCell(
             self.controller_dim,
-            return_sequences=False,
-            return_state=True,
+            kernel_initializer=GlorotUniform(seed=initializer_seed(7)),
+            recurrent_initializer=Orthogonal(seed=initializer_seed(8)),
             name='dnc_controller'
         )
 
-        # define and initialize weights for controller output and interface vectors
-        self.W_output = tf.Variable(  # [Y+I,Y]
-            tf.random.truncated_normal([self.controller_dim, self.output_dim], stddev=0.1),
-            name='dnc_net_output_weights'
+        # the LSTM cell input size is known up front so its weights are created here, outside of
+        # the traced call, the Dense layer is built in build once the input size is known
+        self.lstm_cell.build((1, (self.R + 1) * self.W))
+
+        # content lookups of the write head and read heads, each traced once with its fixed key shape
+        memory_spec = [tf.TensorSpec([self.N, self.W], tf.float32), tf.TensorSpec([self.N, 1], tf.float32)]
+        self._content_lookup_write = tf.function(
+            self.content_lookup,
+            input_signature=memory_spec + [tf.TensorSpec([1, self.W], tf.float32), tf.TensorSpec([1, 1], tf.float32)]
         )
-        self.W_interface = tf.Variable(  # [Y+I,I]
-            tf.random.truncated_normal([self.controller_dim, self.interface_dim], stddev=0.1),
-            name='dnc_interface_weights'
+        self._content_lookup_read = tf.function(
+            self.content_lookup,
+            input_signature=memory_spec + [tf.TensorSpec([self.R, self.W], tf.float32),
+                                           tf.TensorSpec([1, self.R], tf.float32)]
+        )
+
+        # define and initialize weights for controller output and interface vectors,
+        # concatenated so that both are computed with a single matmul
+        # the weights are registered with add_weight so they are part of the model's trainable weights
+        self.W_out_iface = self.add_weight(  # [Y+I,Y+I]
+            name='dnc_output_interface_weights',
+            shape=(self.controller_dim, self.controller_dim),
+            initializer=lambda shape, dtype=None: tf.concat(
+                [truncated_normal([self.controller_dim, self.output_dim], 3),
+                 truncated_normal([self.controller_dim, self.interface_dim], 4)], axis=1
+            )
         )
 
         # output y = v + W_read_out[r(1), ..., r(R)]
-        self.W_read_out = tf.Variable(  # [R*W,Y]
-            tf.random.truncated_normal([self.R * self.W, self.output_dim], stddev=0.1),
-            name='dnc_read_vector_weights'
+        self.W_read_out = self.add_weight(  # [R*W,Y]
+            name='dnc_read_vector_weights',
+            shape=(self.R * self.W, self.output_dim),
+            initializer=lambda shape, dtype=None: truncated_normal(shape, 5)
         )
 
-    def content_lookup(self, key: tf.Tensor, strength: tf.Tensor) -> tf.Tensor:
+    def content_lookup(self, M: tf.Tensor, M_norm: tf.Tensor, key: tf.Tensor, strength: tf.Tensor) -> tf.Tensor:
         """
         Attention mechanism: content based addressing to read from and write to the memory.
 
         Params
         ------
+        M
+            Memory matrix.
+        M_norm
+            Cached l2 norm of each row in the memory matrix.
         key
             Key vector emitted by the controller and used to calculate row-by-row
             cosine similarity with the memory matrix.
@@ -113,85 +203,97 @@ class DNC(tf.keras.Model):
         Similarity measure for each row in the memory used by the read heads for associative
         recall or by the write head to modify a vector in memory.
         """
-        # The l2 norm applied to each key and each row in the memory matrix
-        norm_mem = tf.nn.l2_normalize(self.M, 1)  # [N,W]
+        # The l2 norm applied to each key, the memory rows are divided by their cached norm
         norm_key = tf.nn.l2_normalize(key, 1)  # [1,W] for write or [R,W] for read
 
-        # get similarity measure between both vectors, transpose before multiplication
+        # get cosine similarity measure between both vectors
         # write: [N*W]*[W*1] -> [N*1]
         # read: [N*W]*[W*R] -> [N,R]
-        sim = tf.matmul(norm_mem, norm_key, transpose_b=True)
-        return tf.nn.softmax(sim * strength, 0)  # [N,1] or [N,R]
+        sim = tf.einsum('nw,kw->nk', M, norm_key) / M_norm
+        return self.scaled_softmax(sim, strength)  # [N,1] or [N,R]
+
+    @tf.function(jit_compile=True)
+    def scaled_softmax(self, sim: tf.Tensor, strength: tf.Tensor) -> tf.Tensor:
+        """
+        Softmax over the memory rows of the similarity scaled by the key strength.
+        Compiled with XLA so the scaling, max subtraction, exponent and normalization run as one kernel.
+        """
+        return tf.nn.softmax(sim * strength, axis=0)
 
-    def allocation_weighting(self) -> tf.Tensor:
+    def allocation_weighting(self, usage: tf.Tensor) -> tf.Tensor:
         """
         Memory needs to be freed up and allocated in a differentiable way.
         The usage vector shows how much each memory row is used.
         Unused rows can be written to. Usage of a row increases if
         we write to it and can decrease if we read from it, depending on the free gates.
         Allocation weights are then derived from the usage vector.
+        Only the alloc_k least used rows are sorted and can be allocated, the other rows
+        get no allocation weight although exact allocation would give them the tail of the
+        cumulative product of usages. This is small while some of the alloc_k rows are
+        mostly free, but the error grows as usage approaches 1: with N=100, alloc_k=25 and
+        all usages at 0.95 the allocation weights sum to 0.72 instead of 0.99. Set alloc_k
+        to N for exact allocation.
+
+        Params
+        ------
+        usage
+            Usage vector of the memory rows.
 
         Returns
         -------
         Allocation weights for each row in the memory.
         """
-        # sort usage vector in ascending order and keep original indices of sorted usage vector
-        sorted_usage, free_list = tf.nn.top_k(-1 * tf.transpose(self.usage), k=self.N)
-        sorted_usage *= -1
-        cumprod = tf.math.cumprod(sorted_usage, axis=1, exclusive=True)
+        # sort the alloc_k smallest usages in ascending order and keep their original indices
+        sorted_usage, free_list = tf.math.top_k(-tf.squeeze(usage, 1), k=self.alloc_k)  # [K]
+        # clamp the sorted usage since the gradient of the cumulative product divides by it
+        sorted_usage = tf.maximum(-sorted_usage, 1e-6)  # [K]
+        cumprod = tf.math.cumprod(sorted_usage, exclusive=True)
         unorder = (1 - sorted_usage) * cumprod
 
-        W_alloc = tf.zeros([self.N])
-        I = tf.constant(np.identity(self.N, dtype=np.float32))
-
-        # for each usage vec
-        for pos, idx in enumerate(tf.unstack(free_list[0])):
-            # flatten
-            m = tf.squeeze(tf.slice(I, [idx, 0], [1, -1]))
-            # add to allocation weight matrix
-            W_alloc += m * unorder[0, pos]
+        # scatter the allocation weights back to the original order of the memory rows,
+        # rows outside of the free list get a zero allocation weight
+        W_alloc = tf.scatter_nd(tf.expand_dims(free_list, 1), unorder, [self.N])  # [N]
         # return the allocation weighting for each row in memory
         return tf.reshape(W_alloc, [self.N, 1])
 
-    def controller(self, x: tf.Tensor) -> None:
+    def controller(self,
+                   x: tf.Tensor,
+                   read_v: tf.Tensor,
+                   h: tf.Tensor,
+                   c: tf.Tensor
+                   ) -> Tuple[tf.Tensor, tf.Tensor]:
         """ Update the hidden state of the LSTM controller. """
         # flatten input and pass through dense layer to avoid shape mismatch
         x = tf.reshape(x, [1, -1])
         x = self.dense(x)  # [1,W]
 
-        # concatenate input with read vectors
-        x_in = tf.expand_dims(Concatenate(axis=0)([x, self.read_v]), axis=0)  # [1,R+1,W]
+        # concatenate input with read vectors and flatten them into a single controller input
+        x_in = tf.reshape(tf.concat([x, read_v], axis=0), [1, (self.R + 1) * self.W])  # [1,(R+1)*W]
 
-        # LSTM controller
-        initial_state = [self.h, self.c]
-        _, self.h, self.c = self.lstm(x_in, initial_state=initial_state)
+        # single step of the LSTM controller
+        _, (h, c) = self.lstm_cell(x_in, [h, c])
+        return h, c
 
-    def partition_interface(self):
+    @tf.function(jit_compile=True)
+    def partition_interface(self, interface: tf.Tensor) -> Tuple[tf.Tensor, ...]:
         """
         Partition the interface vector in the read and write keys and strengths,
         the free, allocation and write gates, read modes and erase and write vectors.
         """
-        # convert interface vector into a set of read write vectors
-        partition = tf.constant([[0] * (self.R * self.W) + [1] * self.R +
-                                 [2] * self.W + [3] + [4] * self.W + [5] * self.W +
-                                 [6] * self.R + [7] + [8] + [9] * (self.R * 3)],
-                                dtype=tf.int32)
-
+        # split interface vector into a set of read write vectors with static sizes
         (k_read, b_read, k_write, b_write, erase, write_v, free_gates, alloc_gate,
-         write_gate, read_modes) = tf.dynamic_partition(self.interface, partition, 10)
+         write_gate, read_modes) = tf.split(interface, self.interface_splits, axis=1)
 
         # R read keys and strengths
         k_read = tf.reshape(k_read, [self.R, self.W])  # [R,W]
-        b_read = 1 + tf.nn.softplus(tf.expand_dims(b_read, 0))  # [1,R]
+        b_read = 1 + tf.nn.softplus(b_read)  # [1,R]
 
         # write key, strength, erase and write vectors
-        k_write = tf.expand_dims(k_write, 0)  # [1,W]
-        b_write = 1 + tf.nn.softplus(tf.expand_dims(b_write, 0))  # [1,1]
-        erase = tf.nn.sigmoid(tf.expand_dims(erase, 0))  # [1,W]
-        write_v = tf.expand_dims(write_v, 0)  # [1,W]
+        b_write = 1 + tf.nn.softplus(b_write)  # [1,1]
+        erase = tf.nn.sigmoid(erase)  # [1,W]
 
         # the degree to which locations at read heads will be freed
-        free_gates = tf.nn.sigmoid(tf.expand_dims(free_gates, 0))  # [1,R]
+        free_gates = tf.nn.sigmoid(free_gates)  # [1,R]
 
         # the fraction of writing that is being allocated in a new location
         alloc_gate = tf.reshape(tf.nn.sigmoid(alloc_gate), [1])  # 1
@@ -199,7 +301,7 @@ class DNC(tf.keras.Model):
         # the amount of information to be written to memory
         write_gate = tf.reshape(tf.nn.sigmoid(write_gate), [1])  # 1
 
-        # softmax distribution over the 3 read modes (forward, content lookup, backward)
+        # softmax distribution over the 3 read modes (backward, content lookup, forward)
         read_modes = tf.reshape(read_modes, [3, self.R])  # [3,R]
         read_modes = tf.nn.softmax(read_modes, axis=0)
 
@@ -207,6 +309,11 @@ class DNC(tf.keras.Model):
                 free_gates, alloc_gate, write_gate, read_modes)
 
     def write(self,
+              M: tf.Tensor,
+              M_norm: tf.Tensor,
+              usage: tf.Tensor,
+              W_read: tf.Tensor,
+              W_write: tf.Tensor,
               free_gates: tf.Tensor,
               alloc_gate: tf.Tensor,
               write_gate: tf.Tensor,
@@ -214,98 +321,174 @@ class DNC(tf.keras.Model):
               b_write: tf.Tensor,
               erase: tf.Tensor,
               write_v: tf.Tensor
-              ):
-        """ Write to the memory matrix. """
+              ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor, tf.Tensor]:
+        """
+        Write to the memory matrix and return the updated memory, memory row norms,
+        usage vector and write weights.
+        """
         # memory retention vector represents by how much each location will not be freed by the free gates
-        retention = tf.reduce_prod(1 - free_gates * self.W_read, axis=1)
+        retention = tf.reduce_prod(1 - free_gates * W_read, axis=1)
         retention = tf.reshape(retention, [self.N, 1])  # [N,1]
 
         # update usage vector which is used to dynamically allocate memory
-        self.usage = (self.usage + self.W_write - self.usage * self.W_write) * retention
+        usage = (usage + W_write - usage * W_write) * retention
 
         # compute allocation weights using dynamic memory allocation
-        W_alloc = self.allocation_weighting()  # [N,1]
+        W_alloc = self.allocation_weighting(usage)  # [N,1]
 
         # apply content lookup for the write vector to figure out where to write to
-        W_lookup = self.content_lookup(k_write, b_write)
+        W_lookup = self._content_lookup_write(M, M_norm, k_write, b_write)
         W_lookup = tf.reshape(W_lookup, [self.N, 1])  # [N,1]
 
         # define our write weights now that we know how much space to allocate for them and where to write to
-        self.W_write = write_gate * (alloc_gate * W_alloc + (1 - alloc_gate) * W_lookup)
+        W_write = write_gate * (alloc_gate * W_alloc + (1 - alloc_gate) * W_lookup)
 
         # update memory matrix: erase memory and write using the write weights and vector
-        self.M = (self.M * (1 - tf.matmul(self.W_write, erase)) + tf.matmul(self.W_write, write_v))
+        M, M_norm = self.update_memory(M, W_write, erase, write_v)
+        return M, M_norm, usage, W_write
+
+    @tf.function(jit_compile=True)
+    def update_memory(self,
+                      M: tf.Tensor,
+                      W_write: tf.Tensor,
+                      erase: tf.Tensor,
+                      write_v: tf.Tensor
+                      ) -> Tuple[tf.Tensor, tf.Tensor]:
+        """
+        Erase and write to the memory matrix and return the updated memory with its row norms.
+        Compiled with XLA so the outer products, the update and the norms are fused in a single pass over M.
+        """
+        erase_mat = 1 - tf.einsum('ni,iw->nw', W_write, erase)  # [N,1]*[1,W] -> [N,W]
+        M = M * erase_mat + tf.einsum('ni,iw->nw', W_write, write_v)  # [N,W]
+
+        # the memory only changes here so its row norms are computed once per step
+        M_norm = tf.sqrt(tf.maximum(tf.reduce_sum(tf.square(M), axis=1, keepdims=True), 1e-12))  # [N,1]
+        return M, M_norm
 
     def read(self,
+             M: tf.Tensor,
+             M_norm: tf.Tensor,
+             L: tf.Tensor,
+             W_precedence: tf.Tensor,
+             W_read: tf.Tensor,
+             W_write: tf.Tensor,
              k_read: tf.Tensor,
              b_read: tf.Tensor,
              read_modes: tf.Tensor
-             ):
-        """ Read from the memory matrix. """
+             ) -> Tuple[tf.Tensor, tf.Tensor, tf.Tensor, tf.Tensor]:
+        """
+        Read from the memory matrix and return the updated link matrix,
+        precedence vector, read weights and read vectors.
+        """
         # update memory link matrix used later for the forward and backward read modes
-        W_write_cast = tf.matmul(self.W_write, tf.ones([1, self.N]))  # [N,N]
-        self.L = ((1 - W_write_cast - tf.transpose(W_write_cast)) * self.L +
-                  tf.matmul(self.W_write, self.W_precedence, transpose_b=True))  # [N,N]
-        self.L *= (tf.ones([self.N, self.N]) - tf.constant(np.identity(self.N, dtype=np.float32)))
+        W_write_cast = tf.matmul(W_write, tf.ones([1, self.N]))  # [N,N]
+        L = ((1 - W_write_cast - tf.transpose(W_write_cast)) * L +
+             tf.matmul(W_write, W_precedence, transpose_b=True))  # [N,N]
+        L *= self.L_mask
 
         # update precedence vector which determines degree to which a memory row was written to at t-1
-        self.W_precedence = ((1 - tf.reduce_sum(self.W_write, axis=0)) * self.W_precedence + self.W_write)
+        W_precedence = ((1 - tf.reduce_sum(W_write, axis=0)) * W_precedence + W_write)
 
         # apply content lookup for the read vector(s) to figure out where to read from
-        W_lookup = self.content_lookup(k_read, b_read)
+        W_lookup = self._content_lookup_read(M, M_norm, k_read, b_read)
         W_lookup = tf.reshape(W_lookup, [self.N, self.R])  # [N,R]
 
         # compute forward and backward read weights using the link matrix
         # forward weights recall information written in sequence and backward weights in reverse
-        W_fwd = tf.matmul(self.L, self.W_read)  # [N,N]*[N,R] -> [N,R]
-        W_bwd = tf.matmul(self.L, self.W_read, transpose_a=True)  # [N,R]
+        W_fwd = tf.matmul(L, W_read)  # [N,N]*[N,R] -> [N,R]
+        W_bwd = tf.matmul(L, W_read, transpose_a=True)  # [N,R]
 
-        # 3 modes: forward, backward and content lookup
-        fwd_mode = read_modes[2] * W_fwd
-        lookup_mode = read_modes[1] * W_lookup
-        bwd_mode = read_modes[0] * W_bwd
+        # 3 modes: backward, content lookup and forward, stacked in the order of the read modes
+        W_modes = tf.stack([W_bwd, W_lookup, W_fwd])  # [3,N,R]
 
-        # read weights = backward + content lookup + forward mode weights
-        self.W_read = bwd_mode + lookup_mode + fwd_mode  # [N,R]
+        # read weights = backward + content lookup + forward mode weights, mixed in a single contraction
+        W_read = tf.einsum('mr,mnr->nr', read_modes, W_modes)  # [N,R]
 
         # create read vectors by applying read weights to memory matrix
-        self.read_v = tf.transpose(tf.matmul(self.M, self.W_read, transpose_a=True))  # ([W,N]*[N,R])^T -> [R,W]
+        read_v = tf.transpose(tf.matmul(M, W_read, transpose_a=True))  # ([W,N]*[N,R])^T -> [R,W]
+        return L, W_precedence, W_read, read_v
+
+    def project(self, x: tf.Tensor, weights: tf.Tensor) -> tf.Tensor:
+        """ Multiply x with projection weights in the projection dtype and return the float32 result. """
+        if self.projection_dtype == tf.float32:
+            return tf.matmul(x, weights)
+        y = tf.matmul(tf.cast(x, self.projection_dtype), tf.cast(weights, self.projection_dtype))
+        return tf.cast(y, tf.float32)
 
-    def step(self, x: tf.Tensor) -> tf.Tensor:
+    def step(self, x: tf.Tensor, state: DNCState) -> Tuple[tf.Tensor, DNCState]:
         """
-        Update the controller, compute the output and interface vectors,
-        write to and read from memory and compute the output.
+        Update the controller, compute the output and interface vectors and
+        write to and read from memory for a single timestep. Returns the concatenated
+        controller output and interface vectors and the updated state.
         """
         # update controller
-        self.controller(x)
+        h, c = self.controller(x, state.read_v, state.h, state.c)
 
         # compute output and interface vectors
-        self.output_v = tf.matmul(self.h, self.W_output)  # [1,Y+I] * [Y+I,Y] -> [1,Y]
-        self.interface = tf.matmul(self.h, self.W_interface)  # [1,Y+I] * [Y+I,I] -> [1,I]
+        y = self.project(h, self.W_out_iface)  # [1,Y+I] * [Y+I,Y+I] -> [1,Y+I]
+        output_v, interface = tf.split(y, [self.output_dim, self.interface_dim], axis=1)  # [1,Y], [1,I]
 
         # partition the interface vector
         (k_read, b_read, k_write, b_write, erase, write_v,
-         free_gates, alloc_gate, write_gate, read_modes) = self.partition_interface()
+         free_gates, alloc_gate, write_gate, read_modes) = self.partition_interface(interface)
 
         # write to memory
-        self.write(free_gates, alloc_gate, write_gate, k_write, b_write, erase, write_v)
+        M, M_norm, usage, W_write = self.write(state.M, state.M_norm, state.usage, state.W_read, state.W_write,
+                                               free_gates, alloc_gate, write_gate, k_write, b_write, erase, write_v)
 
         # read from memory
-        self.read(k_read, b_read, read_modes)
+        L, W_precedence, W_read, read_v = self.read(M, M_norm, state.L, state.W_precedence, state.W_read, W_write,
+                                                    k_read, b_read, read_modes)
 
-        # flatten read vectors and multiply them with W matrix before adding to controller output
-        read_v_out = tf.matmul(tf.reshape(self.read_v, [1, self.R * self.W]),
-                               self.W_read_out)  # [1,RW]*[RW,Y] -> [1,Y]
+        return y, DNCState(h, c, M, M_norm, usage, L, W_precedence, W_read, W_write, read_v)
 
-        # compute output
-        y = self.output_v + read_v_out
-        return y
+    def build(self, input_shape: tuple) -> None:
+        """
+        Create the input projection weights once the input size is known. This runs eagerly before
+        the first call, weights created inside the traced call would not receive gradients.
+        """
+        self.dense.build((1, tf.TensorShape(input_shape)[1:].num_elements()))
+        self.built = True
 
+    @tf.function(reduce_retracing=True)
     def call(self, x: Union[np.ndarray, tf.Tensor]) -> tf.Tensor:
-        """ Unstack the input, run through the DNC and return the stacked output. """
-        y = []
-        for x_seq in tf.unstack(x, axis=0):
-            x_seq = tf.expand_dims(x_seq, axis=0)
-            y_seq = self.step(x_seq)
-            y.append(y_seq)
-        return tf.squeeze(tf.stack(y, axis=0))
+        """ Run the input sequence through the DNC and return the stacked output. """
+        # read the state left behind by the previous call and thread it through the timesteps
+        h, c = tf.unstack(self.controller_state)  # [1,Y+I]
+        state = DNCState(h, c, *[tf.convert_to_tensor(getattr(self, name)) for name in DNCState._fields[2:]])
+
+        # the memory state is sequential so the timesteps are run in order, only the
+        # controller outputs (concatenated with the interface vectors) and read vectors needed
+        # for the output are kept
+        n_steps = tf.shape(x)[0]
+        y_seq = tf.TensorArray(tf.float32, size=n_steps)
+        read_v_seq = tf.TensorArray(tf.float32, size=n_steps)
+
+        def body(t, state, y_seq, read_v_seq):
+            y, state = self.step(x[t], state)
+            y_seq = y_seq.write(t, y[0])  # [Y+I]
+            read_v_seq = read_v_seq.write(t, tf.reshape(state.read_v, [self.R * self.W]))  # [RW]
+            return t + 1, state, y_seq, read_v_seq
+
+        _, state, y_seq, read_v_seq = tf.while_loop(
+            lambda t, *_: t < n_steps,
+            body,
+            (tf.constant(0), state, y_seq, read_v_seq),
+            parallel_iterations=1
+        )
+
+        # store the final state in place for the next call
+        self.controller_state.assign(tf.stack([state.h, state.c]))
+        for name, value in zip(DNCState._fields[2:], state[2:]):
+            getattr(self, name).assign(value)
+
+        # compute the output for all timesteps at once: controller output and
+        # flattened read vectors multiplied with their W matrix
+        y = y_seq.stack()  # [T,Y+I]
+        output_v = y[:, :self.output_dim]  # [T,Y]
+        read_v_out = self.project(read_v_seq.stack(), self.W_read_out)  # [T,RW]*[RW,Y] -> [T,Y]
+
+        # keep the controller output and interface vector of the last timestep for inspection
+        self.output_v.assign(output_v[-1:])
+        self.interface.assign(y[-1:, self.output_dim:])
+        return tf.squeeze(output_v + read_v_out)
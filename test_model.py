@@ -0,0 +1,61 @@
+import numpy as np
+import tensorflow as tf
+from model import DNC
+from trainer import trainer
+
+
+def optimized_weights(dnc):
+    # the weights the trainer is expected to optimize: output/interface and read vector
+    # projections, the controller input layer and the LSTM cell
+    return [
+        dnc.W_out_iface, dnc.W_read_out,
+        dnc.dense.kernel, dnc.dense.bias,
+        dnc.lstm_cell.kernel, dnc.lstm_cell.recurrent_kernel, dnc.lstm_cell.bias
+    ]
+
+
+def test_trainer_gradients():
+    X = np.random.rand(1, 6, 4).astype(np.float32)
+    y = np.random.rand(1, 6, 4).astype(np.float32)
+    dnc = DNC(output_dim=4, memory_shape=(10, 4), n_read=2)
+
+    # the trainer raises if none of the optimized weights receive a gradient
+    trainer(
+        model=dnc,
+        loss_fn=tf.keras.losses.mse,
+        X_train=X,
+        y_train=y,
+        optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
+        epochs=1,
+        verbose=False
+    )
+
+    # every weight optimized by the trainer gets a gradient
+    with tf.GradientTape() as tape:
+        loss = tf.reduce_mean(tf.keras.losses.mse(y[0], dnc(X[0])))
+    grads = tape.gradient(loss, dnc.trainable_weights)
+    assert {id(w) for w in dnc.trainable_weights} == {id(w) for w in optimized_weights(dnc)}
+    assert all(g is not None for g in grads)
+    assert all(np.isfinite(g.numpy()).all() for g in grads)
+
+
+def test_mixed_precision():
+    X = np.random.rand(6, 4).astype(np.float32)
+    y = np.random.rand(6, 4).astype(np.float32)
+    dnc = DNC(output_dim=4, memory_shape=(10, 4), n_read=2)
+    dnc_bf16 = DNC(output_dim=4, memory_shape=(10, 4), n_read=2, mixed_precision=True)
+    dnc.build(X.shape)
+    dnc_bf16.build(X.shape)
+    for w, w_bf16 in zip(optimized_weights(dnc), optimized_weights(dnc_bf16)):
+        w_bf16.assign(w)
+
+    # the bfloat16 projections keep the output in float32 and close to the full precision one
+    with tf.GradientTape() as tape:
+        out = dnc_bf16(X)
+        loss = tf.reduce_mean(tf.keras.losses.mse(y, out))
+    assert out.dtype == tf.float32
+    np.testing.assert_allclose(out.numpy(), dnc(X).numpy(), atol=1e-2)
+
+    grads = tape.gradient(loss, optimized_weights(dnc_bf16))
+    assert all(g is not None for g in grads)
+    assert all(np.isfinite(g.numpy()).all() for g in grads)